@@ -35,6 +35,18 @@ def init_spark_session(app_name):
         session = SparkSession \
                 .builder \
                 .appName(app_name) \
+                .config("spark.sql.parquet.filterPushdown", "true") \
+                .config("spark.sql.parquet.enableVectorizedReader", "true") \
+                .config("spark.sql.execution.arrow.pyspark.enabled", "true") \
+                .config("spark.sql.execution.arrow.maxRecordsPerBatch", "8192") \
+                .config("spark.sql.files.maxPartitionBytes", "256MB") \
+                .config("spark.sql.files.openCostInBytes", "8MB") \
+                .config("spark.sql.sources.parallelPartitionDiscovery.threshold", "1") \
+                .config("spark.sql.sources.parallelPartitionDiscovery.parallelism", "32") \
+                .config("spark.sql.adaptive.enabled", "true") \
+                .config("spark.sql.adaptive.coalescePartitions.enabled", "true") \
+                .config("spark.sql.adaptive.skewJoin.enabled", "true") \
+                .config("spark.sql.adaptive.advisoryPartitionSizeInBytes", "64MB") \
                 .getOrCreate()
         context = session.sparkContext
         context.setLogLevel("ERROR")
@@ -63,6 +75,10 @@ def init_test_session(app_name):
                 .config("spark.rdd.compress", "false") \
                 .config("spark.dynamicAllocation.enabled", "false") \
                 .config("spark.io.compression.codec", "lz4") \
+                .config("spark.sql.parquet.filterPushdown", "true") \
+                .config("spark.sql.parquet.enableVectorizedReader", "true") \
+                .config("spark.sql.execution.arrow.pyspark.enabled", "true") \
+                .config("spark.sql.execution.arrow.maxRecordsPerBatch", "8192") \
                 .getOrCreate()
         context = session.sparkContext
         context.setLogLevel("ERROR")
@@ -8,7 +8,7 @@ import tarfile
 
 from listenbrainz_spark import utils, path, schema
 from listenbrainz_spark.hdfs.upload import ListenbrainzDataUploader
-from listenbrainz_spark.path import LISTENBRAINZ_NEW_DATA_DIRECTORY
+from listenbrainz_spark.path import LISTENBRAINZ_NEW_DATA_DIRECTORY, INCREMENTAL_DUMPS_SAVE_PATH
 from listenbrainz_spark.tests import SparkNewTestCase
 
 from pyspark.sql.types import StructField, StructType, StringType
@@ -39,6 +39,11 @@ class HDFSDataUploaderTestCase(SparkNewTestCase):
             ["6.parquet", "5.parquet", "4.parquet", "3.parquet",
              "2.parquet", "1.parquet", "0.parquet"]
         )
+        self.assertCountEqual(
+            utils.get_listen_file_ranges().keys(),
+            ["6.parquet", "5.parquet", "4.parquet", "3.parquet",
+             "2.parquet", "1.parquet", "0.parquet"]
+        )
 
         incremental_dump_tar = self.create_temp_listens_tar('incremental-dump-1')
         self.uploader.upload_new_listens_incremental_dump(incremental_dump_tar.name)
@@ -47,6 +52,7 @@ class HDFSDataUploaderTestCase(SparkNewTestCase):
             ["incremental.parquet", "6.parquet", "5.parquet", "4.parquet",
              "3.parquet", "2.parquet", "1.parquet", "0.parquet"]
         )
+        self.assertIn("incremental.parquet", utils.get_listen_file_ranges())
 
     def test_upload_incremental_listens(self):
         """ Test incremental listen imports work correctly when there are no
@@ -61,3 +67,67 @@ class HDFSDataUploaderTestCase(SparkNewTestCase):
         listens = self.get_all_test_listens()
         # incremental-dump-1 has 9 listens and incremental-dump-2 has 8
         self.assertEqual(listens.count(), 17)
+
+    def assert_listen_file_ranges_correct(self):
+        """ Check that the manifest records the actual listened_at range of every listen file """
+        ranges = utils.get_listen_file_ranges()
+        files = get_listen_files_list()
+        self.assertCountEqual(ranges.keys(), files)
+        for file_name in files:
+            df = utils.read_files_from_HDFS(os.path.join(LISTENBRAINZ_NEW_DATA_DIRECTORY, file_name))
+            self.assertEqual(ranges[file_name], utils.get_listened_at_range(df), file_name)
+
+    def test_listen_file_ranges(self):
+        full_dump_tar = self.create_temp_listens_tar('full-dump')
+        self.uploader.upload_new_listens_full_dump(full_dump_tar.name)
+        self.assert_listen_file_ranges_correct()
+
+        incremental_dump_tar_1 = self.create_temp_listens_tar('incremental-dump-1')
+        self.uploader.upload_new_listens_incremental_dump(incremental_dump_tar_1.name)
+        self.assert_listen_file_ranges_correct()
+
+        incremental_dump_tar_2 = self.create_temp_listens_tar('incremental-dump-2')
+        self.uploader.upload_new_listens_incremental_dump(incremental_dump_tar_2.name)
+        self.assert_listen_file_ranges_correct()
+
+    def test_listen_file_ranges_existing_incremental_dump(self):
+        """ Test that the range of incremental.parquet covers the incremental dumps imported
+        before the manifest existed """
+        full_dump_tar = self.create_temp_listens_tar('full-dump')
+        self.uploader.upload_new_listens_full_dump(full_dump_tar.name)
+        incremental_dump_tar_1 = self.create_temp_listens_tar('incremental-dump-1')
+        self.uploader.upload_new_listens_incremental_dump(incremental_dump_tar_1.name)
+
+        # simulate incremental.parquet having been imported before listen file ranges were recorded
+        ranges = utils.get_listen_file_ranges()
+        del ranges["incremental.parquet"]
+        utils.save_listen_file_ranges(ranges)
+
+        incremental_dump_tar_2 = self.create_temp_listens_tar('incremental-dump-2')
+        self.uploader.upload_new_listens_incremental_dump(incremental_dump_tar_2.name)
+        self.assertEqual(
+            utils.get_listen_file_ranges()["incremental.parquet"],
+            utils.get_listened_at_range(utils.read_files_from_HDFS(INCREMENTAL_DUMPS_SAVE_PATH))
+        )
+
+    def test_listen_files_skipped_using_ranges(self):
+        full_dump_tar = self.create_temp_listens_tar('full-dump')
+        self.uploader.upload_new_listens_full_dump(full_dump_tar.name)
+
+        # give each file a known listened_at range in the manifest, 0.parquet covers 2000,
+        # 1.parquet covers 2001 and so on. 6.parquet is left out of the manifest.
+        ranges = {
+            f"{idx}.parquet": (datetime(2000 + idx, 1, 1), datetime(2000 + idx, 12, 31))
+            for idx in range(6)
+        }
+        utils.save_listen_file_ranges(ranges)
+
+        paths = utils._get_listen_file_paths(datetime(2003, 6, 1), datetime(2004, 6, 1))
+        self.assertListEqual(
+            [Path(p).name for p in paths],
+            ["6.parquet", "4.parquet", "3.parquet"]
+        )
+        paths = utils._get_listen_file_paths(None, datetime(2000, 6, 1))
+        self.assertListEqual([Path(p).name for p in paths], ["6.parquet", "0.parquet"])
+        paths = utils._get_listen_file_paths(datetime(2010, 1, 1), None)
+        self.assertListEqual([Path(p).name for p in paths], ["6.parquet"])
@@ -75,13 +75,33 @@ class ListenbrainzDataUploader(ListenbrainzHDFSUploader):
         # read it in spark in next step
         hdfs_path = self.upload_archive_to_temp(archive, ".parquet")
 
-        # read the parquet file from the temporary path and append
-        # it to incremental.parquet for permanent storage
-        read_files_from_HDFS(hdfs_path) \
+        # widen the listened_at range of incremental.parquet to include the new listens. this is
+        # done before appending the listens so that a failure in between leaves a range which is
+        # too wide rather than one which is too narrow and would cause listens to be skipped.
+        df = read_files_from_HDFS(hdfs_path)
+        listened_at_range = utils.get_listened_at_range(df)
+        if listened_at_range:
+            ranges = utils.get_listen_file_ranges()
+            incremental_file = Path(INCREMENTAL_DUMPS_SAVE_PATH).name
+            if incremental_file in ranges:
+                old_range = ranges[incremental_file]
+            elif path_exists(INCREMENTAL_DUMPS_SAVE_PATH):
+                # incremental dumps imported before the manifest existed are not recorded in it
+                old_range = utils.get_listened_at_range(read_files_from_HDFS(INCREMENTAL_DUMPS_SAVE_PATH))
+            else:
+                old_range = None
+            if old_range:
+                listened_at_range = min(old_range[0], listened_at_range[0]), max(old_range[1], listened_at_range[1])
+            ranges[incremental_file] = listened_at_range
+            utils.save_listen_file_ranges(ranges)
+
+        # append the listens to incremental.parquet for permanent storage
+        df \
             .repartition(1) \
             .write \
             .mode("append") \
             .parquet(INCREMENTAL_DUMPS_SAVE_PATH)
+        utils.invalidate_listen_files_cache()
 
         # delete parquet from hdfs temporary path
         delete_dir(hdfs_path, recursive=True)
@@ -110,8 +130,19 @@ class ListenbrainzDataUploader(ListenbrainzHDFSUploader):
             create_dir(dest_path_parent)
 
         rename(src_path, dest_path)
+        utils.invalidate_listen_files_cache()
         utils.logger.info(f"Done! Time taken: {time.monotonic() - t0:.2f}")
 
+        logger.info("Saving listened_at ranges of the listen files...")
+        self.save_full_dump_listen_file_ranges()
+        logger.info("Done!")
+
+    def save_full_dump_listen_file_ranges(self):
+        """ Compute the minimum and maximum listened_at of each file of the
+        full dump and save those in the listen file ranges manifest. """
+        ranges = utils.get_listened_at_range_per_file(utils.get_listen_files_list())
+        utils.save_listen_file_ranges(ranges)
+
     def upload_mlhd_dump_chunk(self, archive: str):
         """ Upload MLHD+ dump to HDFS """
         dest_path = path.MLHD_PLUS_RAW_DATA_DIRECTORY
@@ -10,6 +10,9 @@ MLHD_PLUS_DATA_DIRECTORY = os.path.join("/", "mlhd")  # processed MLHD+ dump dat
 # path to save incremental dumps
 INCREMENTAL_DUMPS_SAVE_PATH = os.path.join(LISTENBRAINZ_NEW_DATA_DIRECTORY, "incremental.parquet")
 
+# manifest of the minimum and maximum listened_at of each listen file, written at dump import time
+LISTEN_FILES_RANGES_PATH = os.path.join(LISTENBRAINZ_NEW_DATA_DIRECTORY, "listens_ranges.json")
+
 # Directory containing RDD checkpoints to break lineage while using iterative algorithms.
 CHECKPOINT_DIR = os.path.join('/', 'checkpoint')
 
@@ -50,7 +50,7 @@ def search_dump(dump_id: int, dump_type: DumpType, imported_at: datetime) -> boo
 
     result = import_meta_df \
         .filter(import_meta_df.imported_at >= imported_at) \
-        .filter(f"dump_id == '{dump_id}' AND dump_type == '{dump_type.value}'") \
+        .filter((col('dump_id') == dump_id) & (col('dump_type') == dump_type.value)) \
         .count()
 
     return result > 0
@@ -67,7 +67,7 @@ def insert_dump_data(dump_id: int, dump_type: DumpType, imported_at: datetime):
     data = create_dataframe(Row(dump_id, dump_type.value, imported_at), schema=import_metadata_schema)
     if import_meta_df:
         result = import_meta_df \
-            .filter(f"dump_id != '{dump_id}' OR dump_type != '{dump_type.value}'") \
+            .filter((col('dump_id') != dump_id) | (col('dump_type') != dump_type.value)) \
             .union(data)
     else:
         result = data
@@ -1,11 +1,17 @@
-import errno
+import functools
+import inspect
+import json
 import logging
 import os
 from datetime import datetime
-from typing import List, Optional
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Type
+from urllib.parse import urlparse
 
+import pandas
 from py4j.protocol import Py4JJavaError
-from pyspark.sql import DataFrame, functions
+from pyspark import StorageLevel
+from pyspark.sql import DataFrame, Row, functions
+from pyspark.sql.types import StructType
 from pyspark.sql.utils import AnalysisException
 
 import listenbrainz_spark
@@ -18,11 +24,19 @@ from listenbrainz_spark.exceptions import (DataFrameNotAppendedException,
                                            HDFSDirectoryNotDeletedException,
                                            PathNotFoundException,
                                            ViewNotRegisteredException)
-from listenbrainz_spark.path import LISTENBRAINZ_NEW_DATA_DIRECTORY, INCREMENTAL_DUMPS_SAVE_PATH
+from listenbrainz_spark.path import LISTENBRAINZ_NEW_DATA_DIRECTORY, LISTEN_FILES_RANGES_PATH
 from listenbrainz_spark.schema import listens_new_schema
 
 logger = logging.getLogger(__name__)
 
+# options used for all parquet writes. zstd at level 1 gives a better compression ratio than
+# snappy at a similar cpu cost, row groups are sized to match the HDFS block size.
+PARQUET_WRITE_OPTIONS = {
+    "compression": "zstd",
+    "parquet.compression.codec.zstd.level": "1",
+    "parquet.block.size": str(128 * 1024 * 1024),
+}
+
 # A typical listen is of the form:
 # {
 #   "artist_mbids": [],
@@ -39,6 +53,36 @@ logger = logging.getLogger(__name__)
 # All the keys in the dict are column/field names in a Spark dataframe.
 
 
+def translate_errors(mapping: Dict[Type[Exception], Callable[[Exception, dict], Exception]]):
+    """ Decorator to translate the errors raised by the decorated function to our exceptions.
+
+        Args:
+            mapping: dict of the exception types to catch to a callable which receives the caught
+                error and the arguments of the call by name, and returns the exception to raise.
+                The exception types are matched in order.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        caught_types = tuple(mapping.keys())
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                return func(*args, **kwargs)
+            except caught_types as err:
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                for exception_type, translate in mapping.items():
+                    if isinstance(err, exception_type):
+                        raise translate(err, bound.arguments)
+                raise
+        return wrapper
+    return decorator
+
+
+@translate_errors({
+    Py4JJavaError: lambda err, args: DataFrameNotAppendedException(err.java_exception, args['df'].schema)
+})
 def append(df, dest_path):
     """ Append a dataframe to existing dataframe in HDFS or write a new one
         if dataframe does not exist.
@@ -48,37 +92,48 @@ def append(df, dest_path):
             dest_path (string): Path where the existing dataframe is found or
                                 where a new dataframe should be created.
     """
-    try:
-        df.write.mode('append').parquet(config.HDFS_CLUSTER_URI + dest_path)
-    except Py4JJavaError as err:
-        raise DataFrameNotAppendedException(err.java_exception, df.schema)
+    df.write.mode('append').options(**PARQUET_WRITE_OPTIONS).parquet(config.HDFS_CLUSTER_URI + dest_path)
 
 
+@translate_errors({
+    Py4JJavaError: lambda err, args: DataFrameNotCreatedException(err.java_exception, args['row'])
+})
 def create_dataframe(row, schema):
-    """ Create a dataframe containing a single row.
+    """ Create a dataframe containing a single row. If a pandas dataframe or a list of dicts
+        is passed instead, create a dataframe containing all of those rows.
 
         Args:
-            row (pyspark.sql.Row object): A Spark SQL row.
+            row (pyspark.sql.Row object, pandas.DataFrame or list of dicts): A Spark SQL row or rows.
             schema: Dataframe schema.
 
         Returns:
             df (dataframe): Newly created dataframe.
     """
-    try:
-        df = listenbrainz_spark.session.createDataFrame([row], schema=schema)
-        return df
-    except Py4JJavaError as err:
-        raise DataFrameNotCreatedException(err.java_exception, row)
+    if isinstance(row, pandas.DataFrame):
+        # pandas dataframes are sent to the JVM in arrow batches
+        data = row
+    elif isinstance(row, list) and all(isinstance(item, dict) for item in row):
+        # build rows in schema order so that the values are converted the same way as a single
+        # row, going through pandas would turn None into NaN and shift naive timestamps
+        if isinstance(schema, StructType):
+            field_names = schema.fieldNames()
+            data = [tuple(item.get(name) for name in field_names) for item in row]
+        else:
+            data = [Row(**item) for item in row]
+    else:
+        data = [row]
+
+    df = listenbrainz_spark.session.createDataFrame(data, schema=schema)
+    return df
 
 
 def create_path(path):
-    try:
-        os.makedirs(path)
-    except OSError as e:
-        if e.errno != errno.EEXIST:
-            raise
+    os.makedirs(path, exist_ok=True)
 
 
+@translate_errors({
+    Py4JJavaError: lambda err, args: ViewNotRegisteredException(err.java_exception, args['table_name'])
+})
 def register_dataframe(df, table_name):
     """ Creates a view to be used for Spark SQL, etc. Replaces the view if a view with the
         same name exists.
@@ -87,12 +142,13 @@ def register_dataframe(df, table_name):
             df (dataframe): Dataframe to register.
             table_name (str): Name of the view.
     """
-    try:
-        df.createOrReplaceTempView(table_name)
-    except Py4JJavaError as err:
-        raise ViewNotRegisteredException(err.java_exception, table_name)
+    df.createOrReplaceTempView(table_name)
 
 
+@translate_errors({
+    AnalysisException: lambda err, args: PathNotFoundException(str(err), args['path']),
+    Py4JJavaError: lambda err, args: FileNotFetchedException(err.java_exception, args['path'])
+})
 def read_files_from_HDFS(path):
     """ Loads the dataframe stored at the given path in HDFS.
 
@@ -102,22 +158,43 @@ def read_files_from_HDFS(path):
     # if we point spark to a directory, it will read each file in the directory as a
     # parquet file and return the dataframe. so if a non-parquet file in also present
     # in the same directory, we will get the not a parquet file error
-    try:
-        df = listenbrainz_spark.sql_context.read.parquet(config.HDFS_CLUSTER_URI + path)
-        return df
-    except AnalysisException as err:
-        raise PathNotFoundException(str(err), path)
-    except Py4JJavaError as err:
-        raise FileNotFetchedException(err.java_exception, path)
+    df = listenbrainz_spark.sql_context.read \
+        .option("mergeSchema", "false") \
+        .parquet(config.HDFS_CLUSTER_URI + path)
+    return df
 
 
 def get_listen_files_list() -> List[str]:
     """ Get list of name of parquet files containing the listens.
     The list of file names is in order of newest to oldest listens.
     """
+    return list(_get_listen_files_list(_get_listens_directory_modification_time()))
+
+
+def _get_listens_directory_modification_time(strict: bool = True) -> Optional[int]:
+    """ Get the modification time of the listens directory. This changes whenever a file is added to
+    or removed from the directory, so it is used as the cache key for the listen files list and the
+    listen file ranges manifest, which then only need to be read again after an import.
+
+        Args:
+            strict: if False, return None instead of raising an error if the directory does not exist
+    """
+    status = hdfs_connection.client.status(LISTENBRAINZ_NEW_DATA_DIRECTORY, strict=strict)
+    return status['modificationTime'] if status else None
+
+
+def invalidate_listen_files_cache():
+    """ Clear the cached list of listen files and listen file ranges, to be called after importing a dump. """
+    _get_listen_files_list.cache_clear()
+    _get_listen_file_ranges.cache_clear()
+
+
+@functools.lru_cache(maxsize=1)
+def _get_listen_files_list(modification_time: int) -> Tuple[str, ...]:
+    """ List the parquet listen files, cached on the modification time of the listens directory. """
     files = hdfs_connection.client.list(LISTENBRAINZ_NEW_DATA_DIRECTORY)
     has_incremental = False
-    file_names = []
+    numbered_files = []
 
     for file in files:
         # handle incremental dumps separately because later we want to sort
@@ -125,15 +202,17 @@ def get_listen_files_list() -> List[str]:
         if file == "incremental.parquet":
             has_incremental = True
             continue
-        if file.endswith(".parquet"):
-            file_names.append(file)
+        name, _, extension = file.partition(".")
+        if extension == "parquet" and name.isdigit():
+            numbered_files.append((int(name), file))
 
     # parquet files which come from full dump are named as 0.parquet, 1.parquet so
     # on. listens are stored in ascending order of listened_at. so higher the number
     # in the name of the file, newer the listens. Therefore, we sort the list
     # according to numbers in name of parquet files, in reverse order to start
     # loading newer listens first.
-    file_names.sort(key=lambda x: int(x.split(".")[0]), reverse=True)
+    numbered_files.sort(reverse=True)
+    file_names = [file for _, file in numbered_files]
 
     # all incremental dumps are stored in incremental.parquet. these are the newest
     # listens. but an incremental dump might not always exist for example at the time
@@ -142,45 +221,192 @@ def get_listen_files_list() -> List[str]:
     if has_incremental:
         file_names.insert(0, "incremental.parquet")
 
-    return file_names
+    return tuple(file_names)
+
 
+def get_listened_at_range(df: DataFrame) -> Optional[Tuple[datetime, datetime]]:
+    """ Get the minimum and maximum listened_at of the listens in the given dataframe.
+
+        Returns:
+            a tuple of (min listened_at, max listened_at) or None if the dataframe is empty
+    """
+    row = df \
+        .agg(
+            functions.min('listened_at').alias('min_listened_at'),
+            functions.max('listened_at').alias('max_listened_at')
+        ) \
+        .collect()[0]
+    if row['min_listened_at'] is None:
+        return None
+    return row['min_listened_at'], row['max_listened_at']
+
+
+def get_listened_at_range_per_file(file_names: List[str]) -> Dict[str, Tuple[datetime, datetime]]:
+    """ Get the minimum and maximum listened_at of each of the given listen files using a single spark job.
+
+        Args:
+            file_names: names of the listen files, relative to the listens directory
 
-def get_listens_from_dump(start: datetime = None, end: datetime = None) -> DataFrame:
+        Returns:
+            dict of file name to a tuple of (min listened_at, max listened_at), empty files are left out
+    """
+    paths = [config.HDFS_CLUSTER_URI + os.path.join(LISTENBRAINZ_NEW_DATA_DIRECTORY, f) for f in file_names]
+    rows = listenbrainz_spark.session.read \
+        .schema(listens_new_schema) \
+        .parquet(*paths) \
+        .groupBy(functions.input_file_name().alias('input_file')) \
+        .agg(
+            functions.min('listened_at').alias('min_listened_at'),
+            functions.max('listened_at').alias('max_listened_at')
+        ) \
+        .collect()
+
+    ranges = {}
+    for row in rows:
+        # a listen file may be a directory of part files (incremental.parquet), so use the first
+        # component of the input file path relative to the listens directory as the file name
+        relative_path = os.path.relpath(urlparse(row['input_file']).path, LISTENBRAINZ_NEW_DATA_DIRECTORY)
+        file_name = relative_path.split(os.sep)[0]
+        min_ts, max_ts = row['min_listened_at'], row['max_listened_at']
+        if file_name in ranges:
+            old_min, old_max = ranges[file_name]
+            min_ts, max_ts = min(old_min, min_ts), max(old_max, max_ts)
+        ranges[file_name] = min_ts, max_ts
+    return ranges
+
+
+def get_listen_file_ranges() -> Dict[str, Tuple[datetime, datetime]]:
+    """ Get the minimum and maximum listened_at of each listen file from the manifest
+    written at dump import time. An empty dict is returned if the manifest does not exist.
+    """
+    modification_time = _get_listens_directory_modification_time(strict=False)
+    if modification_time is None:
+        return {}
+    return dict(_get_listen_file_ranges(modification_time))
+
+
+@functools.lru_cache(maxsize=1)
+def _get_listen_file_ranges(modification_time: int) -> Dict[str, Tuple[datetime, datetime]]:
+    """ Read the listen file ranges manifest, cached on the modification time of the listens directory.
+    The returned dict is shared between calls and must not be modified.
+    """
+    try:
+        with hdfs_connection.client.read(LISTEN_FILES_RANGES_PATH, encoding='utf-8') as reader:
+            ranges = json.load(reader)
+    except HdfsError:
+        # the manifest does not exist
+        return {}
+    return {
+        file_name: (datetime.fromisoformat(min_ts), datetime.fromisoformat(max_ts))
+        for file_name, (min_ts, max_ts) in ranges.items()
+    }
+
+
+def save_listen_file_ranges(ranges: Dict[str, Tuple[datetime, datetime]]):
+    """ Overwrite the manifest of listened_at ranges of listen files with the given ranges. """
+    data = {
+        file_name: [min_ts.isoformat(), max_ts.isoformat()]
+        for file_name, (min_ts, max_ts) in ranges.items()
+    }
+    hdfs_connection.client.write(LISTEN_FILES_RANGES_PATH, data=json.dumps(data), overwrite=True, encoding='utf-8')
+    _get_listen_file_ranges.cache_clear()
+
+
+def _get_listen_file_paths(start: Optional[datetime], end: Optional[datetime]) -> List[str]:
+    """ Get the full HDFS paths of the listen files which may contain listens with listened_at
+    between start and end, in order of newest to oldest listens.
+    """
+    # the listens directory does not exist if neither a full dump nor an incremental dump has been
+    # imported yet, there are no listen files in that case.
+    modification_time = _get_listens_directory_modification_time(strict=False)
+    if modification_time is None:
+        return []
+    files = _get_listen_files_list(modification_time)
+
+    # use the listened_at ranges recorded at import time to skip files which cannot contain any listens
+    # in the requested range without running a spark job. files missing from the manifest are always read.
+    ranges = _get_listen_file_ranges(modification_time)
+    return [
+        config.HDFS_CLUSTER_URI + os.path.join(LISTENBRAINZ_NEW_DATA_DIRECTORY, f)
+        for f in files
+        if f not in ranges or ((not start or ranges[f][1] >= start) and (not end or ranges[f][0] <= end))
+    ]
+
+
+def _read_listens(paths: List[str], start: Optional[datetime], end: Optional[datetime]) -> DataFrame:
+    """ Read the listens with listened_at between start and end from the given listen files. """
+    # listened_at is stored as INT96 for which parquet keeps no statistics, so these filters cannot
+    # skip row groups. files outside the range are pruned by _get_listen_file_paths instead.
+    df = listenbrainz_spark.session.read.schema(listens_new_schema).parquet(*paths)
+    if start:
+        df = df.where(functions.col("listened_at") >= functions.lit(start))
+    if end:
+        df = df.where(functions.col("listened_at") <= functions.lit(end))
+    return df
+
+
+def get_listens_from_dump(start: datetime = None, end: datetime = None, cache: bool = False) -> DataFrame:
     """ Load listens with listened_at between from_ts and to_ts from HDFS in a spark dataframe.
 
         Args:
             start: minimum time to include a listen in the dataframe
             end: maximum time to include a listen in the dataframe
+            cache: whether to persist the dataframe, useful if the caller runs multiple actions on it.
+                The dataframe is materialized before returning because persisting is lazy. Call
+                unpersist_listens on it once done.
 
         Returns:
             dataframe of listens with listened_at between start and end
     """
-    df = listenbrainz_spark.session.createDataFrame([], listens_new_schema)
+    paths = _get_listen_file_paths(start, end)
+    if not paths:
+        return listenbrainz_spark.session.createDataFrame([], listens_new_schema)
 
-    # full dump directory always exists because the incremental dumps are stored in a nested dir inside it
-    # therefore to check existence of full dump, we instead need to check whether a parquet file of the full
-    # dump exists. since files are number from 0, we check for 0.parquet
-    full_dump_test_path = os.path.join(LISTENBRAINZ_NEW_DATA_DIRECTORY, "0.parquet")
-    if hdfs_connection.client.status(full_dump_test_path, strict=False):
-        full_df = read_files_from_HDFS(LISTENBRAINZ_NEW_DATA_DIRECTORY)
-        df = df.union(full_df)
-    if hdfs_connection.client.status(INCREMENTAL_DUMPS_SAVE_PATH, strict=False):
-        inc_df = read_files_from_HDFS(INCREMENTAL_DUMPS_SAVE_PATH)
-        df = df.union(inc_df)
+    # read all the listen files in a single scan instead of unioning one dataframe per file
+    df = _read_listens(paths, start, end)
 
-    if start:
-        df = df.where(f"listened_at >= to_timestamp('{start}')")
-    if end:
-        df = df.where(f"listened_at <= to_timestamp('{end}')")
+    if cache:
+        df = df.persist(StorageLevel.MEMORY_AND_DISK)
+        df.count()
 
     return df
 
 
+def iter_listens_from_dump(start: datetime = None, end: datetime = None) -> Iterator[DataFrame]:
+    """ Load listens with listened_at between from_ts and to_ts from HDFS, one spark dataframe
+        per listen file in order of newest to oldest listens. Useful for callers which can
+        process the listens incrementally, for instance by folding an aggregate over the files,
+        instead of building a plan over all the listens at once.
+
+        Args:
+            start: minimum time to include a listen in the dataframes
+            end: maximum time to include a listen in the dataframes
+
+        Returns:
+            iterator of dataframes of listens with listened_at between start and end
+    """
+    for file_path in _get_listen_file_paths(start, end):
+        yield _read_listens([file_path], start, end)
+
+
+def unpersist_listens(df: DataFrame):
+    """ Free the storage of a listens dataframe obtained with get_listens_from_dump(cache=True). """
+    df.unpersist()
+
+
 def get_latest_listen_ts() -> datetime:
     """" Get the listened_at time of the latest listen present
      in the imported dumps
      """
-    latest_listen_file = get_listen_files_list()[0]
+    modification_time = _get_listens_directory_modification_time()
+    latest_listen_file = _get_listen_files_list(modification_time)[0]
+
+    # the listened_at range of the latest listen file recorded at import time already contains the
+    # time of the latest listen. fallback to a spark job if the file is missing from the manifest.
+    ranges = _get_listen_file_ranges(modification_time)
+    if latest_listen_file in ranges:
+        return ranges[latest_listen_file][1]
+
     df = read_files_from_HDFS(
         os.path.join(LISTENBRAINZ_NEW_DATA_DIRECTORY, latest_listen_file)
     )
@@ -190,6 +416,9 @@ def get_latest_listen_ts() -> datetime:
         .collect()[0]['latest_listen_ts']
 
 
+@translate_errors({
+    Py4JJavaError: lambda err, args: FileNotSavedException(err.java_exception, args['path'])
+})
 def save_parquet(df, path, mode='overwrite'):
     """ Save dataframe as parquet to given path in HDFS.
 
@@ -198,10 +427,7 @@ def save_parquet(df, path, mode='overwrite'):
             path (str): Path in HDFS to save the dataframe.
             mode (str): The mode with which to write the paquet.
     """
-    try:
-        df.write.format('parquet').save(config.HDFS_CLUSTER_URI + path, mode=mode)
-    except Py4JJavaError as err:
-        raise FileNotSavedException(err.java_exception, path)
+    df.write.format('parquet').options(**PARQUET_WRITE_OPTIONS).save(config.HDFS_CLUSTER_URI + path, mode=mode)
 
 
 def read_json(hdfs_path, schema):
@@ -214,5 +440,10 @@ def read_json(hdfs_path, schema):
         Returns:
             df (parquet): Dataframe.
     """
-    df = listenbrainz_spark.session.read.json(config.HDFS_CLUSTER_URI + hdfs_path, schema=schema)
+    # fail on malformed records instead of silently turning them into rows of nulls, a single
+    # malformed record makes the whole read fail when the dataframe is evaluated
+    df = listenbrainz_spark.session.read \
+        .schema(schema) \
+        .option("mode", "FAILFAST") \
+        .json(config.HDFS_CLUSTER_URI + hdfs_path)
     return df
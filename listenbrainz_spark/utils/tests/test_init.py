@@ -1,6 +1,7 @@
 import os
 import tempfile
 from datetime import datetime
+from unittest.mock import patch
 
 from listenbrainz_spark.tests import SparkNewTestCase
 from listenbrainz_spark import utils
@@ -10,7 +11,10 @@ from listenbrainz_spark.hdfs.utils import path_exists
 from listenbrainz_spark.hdfs.utils import upload_to_HDFS
 from listenbrainz_spark.hdfs.utils import rename
 from listenbrainz_spark.hdfs.utils import copy
+from py4j.protocol import Py4JJavaError
+from pyspark import StorageLevel
 from pyspark.sql import Row
+from pyspark.sql.types import StructType, StructField, IntegerType, StringType, TimestampType
 
 
 class UtilsTestCase(SparkNewTestCase):
@@ -46,6 +50,46 @@ class UtilsTestCase(SparkNewTestCase):
         received_df = utils.read_files_from_HDFS(hdfs_path)
         self.assertEqual(received_df.count(), 1)
 
+    def test_create_dataframe_from_dicts(self):
+        schema = StructType([
+            StructField('column1', IntegerType(), nullable=False),
+            StructField('column2', StringType(), nullable=True),
+        ])
+        rows = [{'column2': 'a', 'column1': 1}, {'column1': 2, 'column2': None}]
+        df = utils.create_dataframe(rows, schema=schema)
+        self.assertListEqual(df.collect(), [Row(column1=1, column2='a'), Row(column1=2, column2=None)])
+
+    def test_create_dataframe_from_dicts_ddl_schema(self):
+        rows = [{'column1': 1, 'column2': 'a'}, {'column1': 2, 'column2': 'b'}]
+        df = utils.create_dataframe(rows, schema='column1 INT, column2 STRING')
+        self.assertListEqual(df.collect(), [Row(column1=1, column2='a'), Row(column1=2, column2='b')])
+
+    def test_create_dataframe_from_dicts_timestamp(self):
+        schema = StructType([
+            StructField('column1', IntegerType(), nullable=False),
+            StructField('listened_at', TimestampType(), nullable=False),
+        ])
+        listened_at = datetime(2021, 8, 9, 12, 22, 43)
+        df = utils.create_dataframe([{'column1': 1, 'listened_at': listened_at}], schema=schema)
+        row_df = utils.create_dataframe(Row(column1=1, listened_at=listened_at), schema=schema)
+        self.assertListEqual(df.collect(), [Row(column1=1, listened_at=listened_at)])
+        self.assertListEqual(df.collect(), row_df.collect())
+
+    def test_create_dataframe_from_dicts_null_integer(self):
+        schema = StructType([
+            StructField('column1', IntegerType(), nullable=True),
+            StructField('column2', StringType(), nullable=True),
+        ])
+        rows = [{'column1': None, 'column2': 'a'}, {'column1': 2, 'column2': 'b'}]
+        df = utils.create_dataframe(rows, schema=schema)
+        self.assertListEqual(df.collect(), [Row(column1=None, column2='a'), Row(column1=2, column2='b')])
+
+    def test_create_dataframe_from_empty_list(self):
+        schema = StructType([StructField('column1', IntegerType(), nullable=True)])
+        df = utils.create_dataframe([], schema=schema)
+        self.assertEqual(df.count(), 0)
+        self.assertEqual(df.schema, schema)
+
     def test_create_dir(self):
         create_dir(self.path_)
         status = path_exists(self.path_)
@@ -78,6 +122,36 @@ class UtilsTestCase(SparkNewTestCase):
         status = path_exists(self.path_)
         self.assertTrue(status)
 
+    def test_read_json(self):
+        schema = StructType([
+            StructField('column1', IntegerType(), nullable=True),
+            StructField('column2', StringType(), nullable=True),
+        ])
+        local_path = os.path.join(tempfile.mkdtemp(), 'valid.json')
+        with open(local_path, 'w') as f:
+            f.write('{"column1": 1, "column2": "a"}\n{"column1": 2, "column2": "b"}\n')
+        hdfs_path = os.path.join(self.path_, 'valid.json')
+        upload_to_HDFS(hdfs_path, local_path)
+
+        df = utils.read_json(hdfs_path, schema=schema)
+        self.assertListEqual(df.collect(), [Row(column1=1, column2='a'), Row(column1=2, column2='b')])
+
+    def test_read_json_malformed_record(self):
+        schema = StructType([
+            StructField('column1', IntegerType(), nullable=True),
+            StructField('column2', StringType(), nullable=True),
+        ])
+        local_path = os.path.join(tempfile.mkdtemp(), 'malformed.json')
+        with open(local_path, 'w') as f:
+            f.write('{"column1": 1, "column2": "a"}\n{"column1": 2, "column2": \n')
+        hdfs_path = os.path.join(self.path_, 'malformed.json')
+        upload_to_HDFS(hdfs_path, local_path)
+
+        # a malformed record fails the whole read instead of being returned as a row of nulls
+        df = utils.read_json(hdfs_path, schema=schema)
+        with self.assertRaises(Py4JJavaError):
+            df.collect()
+
     def test_rename(self):
         create_dir(self.path_)
         test_exists = path_exists(self.path_)
@@ -121,3 +195,80 @@ class UtilsTestCase(SparkNewTestCase):
         self.upload_test_listens()
         self.assertEqual(utils.get_latest_listen_ts(), datetime(2021, 8, 9, 12, 22, 43))
         self.delete_uploaded_listens()
+
+    def test_get_latest_listen_ts_without_ranges(self):
+        """ Test that the latest listen time is computed from the listens if the
+        latest listen file is not recorded in the listen file ranges manifest """
+        self.upload_test_listens()
+        ranges = utils.get_listen_file_ranges()
+        del ranges["incremental.parquet"]
+        utils.save_listen_file_ranges(ranges)
+        self.assertEqual(utils.get_latest_listen_ts(), datetime(2021, 8, 9, 12, 22, 43))
+        self.delete_uploaded_listens()
+
+    @patch("listenbrainz_spark.utils.hdfs_connection.client")
+    def test_get_listen_files_list_cached(self, mock_client):
+        utils.invalidate_listen_files_cache()
+        mock_client.status.return_value = {"modificationTime": 1}
+        mock_client.list.return_value = ["0.parquet", "incremental.parquet", "1.parquet"]
+        expected = ["incremental.parquet", "1.parquet", "0.parquet"]
+
+        self.assertListEqual(utils.get_listen_files_list(), expected)
+        self.assertListEqual(utils.get_listen_files_list(), expected)
+        mock_client.list.assert_called_once()
+
+        # directory was modified, the files should be listed again
+        mock_client.status.return_value = {"modificationTime": 2}
+        self.assertListEqual(utils.get_listen_files_list(), expected)
+        self.assertEqual(mock_client.list.call_count, 2)
+        utils.invalidate_listen_files_cache()
+
+    @patch("listenbrainz_spark.utils.hdfs_connection.client")
+    def test_get_listen_file_paths_hdfs_calls(self, mock_client):
+        """ Test that repeated reads of listens only check the status of the listens directory """
+        utils.invalidate_listen_files_cache()
+        mock_client.status.return_value = {"modificationTime": 1}
+        mock_client.list.return_value = ["0.parquet", "1.parquet"]
+        mock_client.read.return_value.__enter__.return_value.read.return_value = \
+            '{"0.parquet": ["2021-01-01T00:00:00", "2021-06-30T00:00:00"]}'
+
+        for _ in range(3):
+            paths = utils._get_listen_file_paths(datetime(2021, 7, 1), None)
+            self.assertListEqual([os.path.basename(p) for p in paths], ["1.parquet"])
+        self.assertEqual(mock_client.status.call_count, 3)
+        mock_client.list.assert_called_once()
+        mock_client.read.assert_called_once()
+        utils.invalidate_listen_files_cache()
+
+    def test_get_listens_from_dump(self):
+        self.upload_test_listens()
+        all_listens = utils.get_listens_from_dump().collect()
+
+        start, end = datetime(2021, 8, 1), datetime(2021, 8, 9)
+        listens = utils.get_listens_from_dump(start, end).collect()
+        expected = [listen for listen in all_listens if start <= listen.listened_at <= end]
+        self.assertCountEqual(listens, expected)
+        self.delete_uploaded_listens()
+
+    def test_get_listens_from_dump_cached(self):
+        self.upload_test_listens()
+        df = utils.get_listens_from_dump(self.begin_date, self.end_date, cache=True)
+        self.assertTrue(df.is_cached)
+        self.assertEqual(str(df.storageLevel), str(StorageLevel.MEMORY_AND_DISK))
+
+        utils.unpersist_listens(df)
+        self.assertFalse(df.is_cached)
+        self.assertFalse(df.storageLevel.useMemory)
+        self.assertFalse(df.storageLevel.useDisk)
+        self.delete_uploaded_listens()
+
+    def test_iter_listens_from_dump(self):
+        self.upload_test_listens()
+        start, end = datetime(2021, 8, 1), datetime(2021, 8, 9)
+        expected = utils.get_listens_from_dump(start, end).collect()
+
+        listens = []
+        for df in utils.iter_listens_from_dump(start, end):
+            listens.extend(df.collect())
+        self.assertCountEqual(listens, expected)
+        self.delete_uploaded_listens()